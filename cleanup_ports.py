@@ -1,72 +1,88 @@
-import os
 import sys
-import requests
-from dotenv import load_dotenv
+import atexit
+import logging
+import logging.handlers
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+from config import NEUTRON_API_URL, NOVA_API_URL, CLEANUP_WORKERS, CONFIG, create_session
 
 # Принудительная кодировка UTF-8 для Windows
 if sys.platform == 'win32':
     sys.stdout.reconfigure(encoding='utf-8')
 
-load_dotenv(override=True)
-
-TOKEN = os.getenv('VK_CLOUD_AUTH_TOKEN')
-NEUTRON_URL = 'https://infra.mail.ru:9696/v2.0'
-NOVA_URL = 'https://infra.mail.ru:8774/v2.1'
-VM_ID = os.getenv('VM_ID')
+# Потоки очистки только кладут записи в очередь, вывод в stdout делает отдельный поток
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(message)s',
+    handlers=[logging.handlers.QueueHandler(log_queue)]
+)
+log_listener.start()
+atexit.register(log_listener.stop)
+logger = logging.getLogger(__name__)
 
-if not TOKEN:
-    print("Токен не найден в .env")
+if not CONFIG.vk_cloud_token:
+    logger.error("Токен не найден в .env")
     sys.exit(1)
 
-headers = {
-    'X-Auth-Token': TOKEN,
-    'Content-Type': 'application/json'
-}
+for error in CONFIG.errors:
+    logger.warning(f"{error} - используется значение по умолчанию")
 
-def get_vm_interfaces():
+def get_vm_interfaces(session):
     """Получить список ID портов, подключенных к целевой ВМ"""
     try:
-        url = f"{NOVA_URL}/servers/{VM_ID}/os-interface"
-        resp = requests.get(url, headers=headers, timeout=10)
+        url = f"{NOVA_API_URL}/servers/{CONFIG.vm_id}/os-interface"
+        resp = session.get(url, timeout=CONFIG.request_timeout)
         if resp.status_code == 200:
             return [iface['port_id'] for iface in resp.json().get('interfaceAttachments', [])]
     except Exception:
         pass
     return []
 
-SAFE_IP = os.getenv('SAFE_IP')
-if not SAFE_IP:
-    print("SAFE_IP не найден в .env. Укажите IP основного интерфейса ВМ.")
+if not CONFIG.safe_ip:
+    logger.error("SAFE_IP не найден в .env. Укажите IP основного интерфейса ВМ.")
     sys.exit(1)
 
-def detach_and_delete(port_id):
-    print(f"Отключение порта {port_id} от ВМ...")
+def detach_and_delete(session, port_id):
+    logger.info(f"Отключение порта {port_id} от ВМ...")
     try:
-        requests.delete(f"{NOVA_URL}/servers/{VM_ID}/os-interface/{port_id}", headers=headers, timeout=10)
+        session.delete(f"{NOVA_API_URL}/servers/{CONFIG.vm_id}/os-interface/{port_id}", timeout=CONFIG.request_timeout)
     except Exception as e:
-        print(f"   Ошибка отключения (возможно уже отключен): {e}")
+        logger.warning(f"   {port_id}: ошибка отключения (возможно уже отключен): {e}")
     
-    print(f"Удаление порта {port_id}...")
+    logger.info(f"Удаление порта {port_id}...")
     try:
-        requests.delete(f"{NEUTRON_URL}/ports/{port_id}", headers=headers, timeout=10)
-        print("   Удален")
+        session.delete(f"{NEUTRON_API_URL}/ports/{port_id}", timeout=CONFIG.request_timeout)
+        logger.info(f"   {port_id}: удален")
         return True
     except Exception as e:
-        print(f"   Ошибка удаления: {e}")
+        logger.error(f"   {port_id}: ошибка удаления: {e}")
         return False
 
-def cleanup():
-    print("Анализ портов...")
+def list_ports(session, device_id):
+    """Получить порты с указанным device_id (пустая строка - непривязанные порты)"""
+    params = {'device_id': device_id, 'fields': ['id', 'device_id', 'fixed_ips']}
+    resp = session.get(f"{NEUTRON_API_URL}/ports", params=params, timeout=CONFIG.request_timeout)
+    resp.raise_for_status()
+    return resp.json().get('ports', [])
+
+def cleanup(session):
+    logger.info("Анализ портов...")
     
     try:
-        resp = requests.get(f"{NEUTRON_URL}/ports", headers=headers, timeout=30)
-        resp.raise_for_status()
-        all_ports = resp.json().get('ports', [])
+        # Фильтруем на стороне Neutron: нужны только висячие порты и порты нашей ВМ
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            detached_ports, vm_ports = executor.map(lambda device_id: list_ports(session, device_id), ('', CONFIG.vm_id))
+        # Без расширения empty-string-filtering Neutron игнорирует device_id='' и отдаёт
+        # все порты - порты ВМ придут в обоих ответах, поэтому объединяем по id
+        all_ports = list({port['id']: port for port in detached_ports + vm_ports}.values())
     except Exception as e:
-        print(f"Ошибка получения списка портов: {e}")
+        logger.error(f"Ошибка получения списка портов: {e}")
         return
 
-    deleted_count = 0
+    targets = []
     
     for port in all_ports:
         port_id = port.get('id')
@@ -74,24 +90,29 @@ def cleanup():
         ips = [ip['ip_address'] for ip in port.get('fixed_ips', [])]
         
         # Если это наш SAFE_IP - пропускаем
-        if SAFE_IP in ips:
-            print(f"Порт {port_id} ({ips}) ЗАЩИЩЕН (SAFE_IP). Пропуск.")
+        if CONFIG.safe_ip in ips:
+            logger.info(f"Порт {port_id} ({ips}) ЗАЩИЩЕН (SAFE_IP). Пропуск.")
             continue
             
         # Если порт висит (не привязан) - удаляем
         if not device_id:
-             print(f"Found detached port {port_id} ({ips})")
-             if detach_and_delete(port_id):
-                 deleted_count += 1
+             logger.info(f"Found detached port {port_id} ({ips})")
+             targets.append(port_id)
                  
         # Если порт привязан к НАШЕЙ ВМ, но это не SAFE_IP - удаляем
-        elif device_id == VM_ID:
-             print(f"Found attached EXTRA port {port_id} ({ips}) on our VM")
-             if detach_and_delete(port_id):
-                 deleted_count += 1
-                 
-    print(f"\nОчистка завершена. Удалено портов: {deleted_count}")
+        elif device_id == CONFIG.vm_id:
+             logger.info(f"Found attached EXTRA port {port_id} ({ips}) on our VM")
+             targets.append(port_id)
+    
+    deleted_count = 0
+    if targets:
+        # Порты независимы друг от друга - отключаем и удаляем параллельно
+        with ThreadPoolExecutor(max_workers=min(CLEANUP_WORKERS, len(targets))) as executor:
+            deleted_count = sum(executor.map(lambda port_id: detach_and_delete(session, port_id), targets))
+    
+    logger.info(f"\nОчистка завершена. Удалено портов: {deleted_count}")
 
 
 if __name__ == "__main__":
-    cleanup()
\ No newline at end of file
+    with create_session(pool_maxsize=CLEANUP_WORKERS, max_retries=3) as session:
+        cleanup(session)
\ No newline at end of file
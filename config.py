@@ -0,0 +1,148 @@
+"""
+Общая конфигурация VK Cloud Network Interface Manager
+.env и переменные окружения читаются один раз при импорте модуля в неизменяемый CONFIG
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+NOVA_API_URL = 'https://infra.mail.ru:8774/v2.1'
+NEUTRON_API_URL = 'https://infra.mail.ru:9696/v2.0'
+
+CLEANUP_WORKERS = 16
+
+STATUS_RETRIES = 3
+RETRY_AFTER_MAX = 10
+
+@dataclass(frozen=True)
+class Config:
+    """Параметры запуска, уже приведённые к нужным типам"""
+
+    # VK Cloud
+    vk_cloud_token: Optional[str]
+    project_id: Optional[str]
+    region: str
+    vm_id: Optional[str]
+    external_network_id: str
+    num_ports: int
+    safe_ip: Optional[str]
+
+    # Telegram
+    telegram_bot_token: Optional[str]
+    telegram_chat_id: Optional[str]
+
+    # Диапазоны IP
+    ip_range_1_start: str
+    ip_range_1_end: str
+    ip_range_2_start: str
+    ip_range_2_end: str
+
+    # Логирование
+    log_level: str
+    log_file: str
+
+    # Таймауты и повторы
+    ip_wait_timeout: int
+    check_interval: float
+    poll_backoff_base: float
+    max_retries: int
+    connect_timeout: float
+    read_timeout: float
+    # Раздельные таймауты (подключение, чтение): зависший TCP/TLS handshake
+    # обрывается быстро и уходит в retry, а медленный ответ API получает своё время
+    request_timeout: Tuple[float, float]
+    # Создание и подключение порта в менеджере: POST не повторяется urllib3,
+    # поэтому медленный, но успешный ответ нужно дождаться
+    post_read_timeout: float
+    post_timeout: Tuple[float, float]
+
+    # Нечисловые значения заменяются значением по умолчанию, а сообщение попадает сюда:
+    # каждый скрипт сам решает, критичны ли они, вместо ValueError при импорте
+    errors: Tuple[str, ...]
+
+def parse_number(env: Dict[str, str], name: str, default: str, convert: Callable, errors: List[str]):
+    """Прочитать числовой параметр; при ошибке записать её и вернуть значение по умолчанию"""
+    value = env.get(name, default)
+    try:
+        return convert(value)
+    except ValueError:
+        errors.append(f"{name} должен быть числом: {value}")
+        return convert(default)
+
+def load_config() -> Config:
+    """Загрузить .env и собрать конфигурацию за один проход по окружению"""
+    load_dotenv(override=True)
+    env = dict(os.environ)
+    errors: List[str] = []
+
+    connect_timeout = parse_number(env, 'CONNECT_TIMEOUT', '3.05', float, errors)
+    read_timeout = parse_number(env, 'READ_TIMEOUT', '10', float, errors)
+    post_read_timeout = parse_number(env, 'POST_READ_TIMEOUT', '60', float, errors)
+
+    return Config(
+        vk_cloud_token=env.get('VK_CLOUD_AUTH_TOKEN'),
+        project_id=env.get('VK_CLOUD_PROJECT_ID'),
+        region=env.get('VK_CLOUD_REGION', 'RegionOne'),
+        vm_id=env.get('VM_ID'),
+        external_network_id=env.get('EXTERNAL_NETWORK_ID', 'ext-net'),
+        num_ports=parse_number(env, 'NUM_PORTS', '5', int, errors),
+        safe_ip=env.get('SAFE_IP'),
+        telegram_bot_token=env.get('TELEGRAM_BOT_TOKEN'),
+        telegram_chat_id=env.get('TELEGRAM_CHAT_ID'),
+        ip_range_1_start=env.get('IP_RANGE_1_START', '95.163.248.10'),
+        ip_range_1_end=env.get('IP_RANGE_1_END', '95.163.251.250'),
+        ip_range_2_start=env.get('IP_RANGE_2_START', '217.16.24.1'),
+        ip_range_2_end=env.get('IP_RANGE_2_END', '217.16.27.253'),
+        log_level=env.get('LOG_LEVEL', 'INFO'),
+        log_file=env.get('LOG_FILE', 'vk_cloud_manager.log'),
+        ip_wait_timeout=parse_number(env, 'IP_WAIT_TIMEOUT', '60', int, errors),
+        check_interval=parse_number(env, 'CHECK_INTERVAL', '2', float, errors),
+        poll_backoff_base=parse_number(env, 'POLL_BACKOFF_BASE', '0.1', float, errors),
+        max_retries=parse_number(env, 'MAX_RETRIES', '100', int, errors),
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        request_timeout=(connect_timeout, read_timeout),
+        post_read_timeout=post_read_timeout,
+        post_timeout=(connect_timeout, post_read_timeout),
+        errors=tuple(errors),
+    )
+
+CONFIG = load_config()
+
+# Токен читается один раз при старте и не меняется во время работы
+HEADERS = {
+    'X-Auth-Token': CONFIG.vk_cloud_token,
+    'Content-Type': 'application/json',
+    'Accept': 'application/json'
+}
+
+class CappedRetry(Retry):
+    """Retry, который соблюдает Retry-After, но ждёт не дольше RETRY_AFTER_MAX"""
+
+    def get_retry_after(self, response) -> Optional[float]:
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, RETRY_AFTER_MAX)
+
+def create_session(pool_maxsize: int, max_retries: int) -> requests.Session:
+    """Создание сессии с пулом соединений и retry стратегией"""
+    session = requests.Session()
+    # На 429/5xx темп задаёт Retry-After, но пауза ограничена сверху:
+    # ожидание внутри urllib3 не прерывается по Ctrl+C
+    retry = CappedRetry(
+        total=max_retries,
+        status=STATUS_RETRIES,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 504)
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(HEADERS)
+    return session
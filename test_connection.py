@@ -3,20 +3,9 @@
 Тестирование подключения к VK Cloud API
 """
 
-import os
 import sys
-from dotenv import load_dotenv
-import requests
 
-load_dotenv(override=True)
-
-VK_CLOUD_TOKEN = os.getenv('VK_CLOUD_AUTH_TOKEN')
-PROJECT_ID = os.getenv('VK_CLOUD_PROJECT_ID')
-NOVA_API_URL = 'https://infra.mail.ru:8774/v2.1'
-NEUTRON_API_URL = 'https://infra.mail.ru:9696/v2.0'
-
-VM_ID = os.getenv('VM_ID')
-EXTERNAL_NETWORK_ID = os.getenv('EXTERNAL_NETWORK_ID')
+from config import NOVA_API_URL, NEUTRON_API_URL, CONFIG, create_session
 
 def test_connection():
     """Тестирование подключения к API"""
@@ -25,10 +14,10 @@ def test_connection():
     
     # Проверка конфигурации
     checks = {
-        "VK_CLOUD_AUTH_TOKEN": VK_CLOUD_TOKEN,
-        "VK_CLOUD_PROJECT_ID": PROJECT_ID,
-        "VM_ID": VM_ID,
-        "EXTERNAL_NETWORK_ID": EXTERNAL_NETWORK_ID,
+        "VK_CLOUD_AUTH_TOKEN": CONFIG.vk_cloud_token,
+        "VK_CLOUD_PROJECT_ID": CONFIG.project_id,
+        "VM_ID": CONFIG.vm_id,
+        "EXTERNAL_NETWORK_ID": CONFIG.external_network_id,
         "NOVA_API_URL": NOVA_API_URL,
         "NEUTRON_API_URL": NEUTRON_API_URL
     }
@@ -38,35 +27,45 @@ def test_connection():
         status = "OK" if value else "ОШИБКА"
         display_value = value[:20] + "..." if len(str(value)) > 20 else value
         print(f"  {status} {key}: {display_value}")
+    for error in CONFIG.errors:
+        print(f"  ОШИБКА {error}")
     
     if not all(checks.values()):
         print("\nНе все параметры конфигурации установлены!")
         return False
+    if CONFIG.errors:
+        print("\nВ конфигурации есть некорректные значения!")
+        return False
     
     # Тест API
     print("\nТестирование API запросов:")
     
-    headers = {
-        'X-Auth-Token': VK_CLOUD_TOKEN,
-        'Content-Type': 'application/json'
-    }
-    
+    with create_session(pool_maxsize=4, max_retries=3) as session:
+        return run_api_checks(session)
+
+def run_api_checks(session):
+    """Проверка Neutron и Nova API через общую сессию"""
     # Тест 1: Проверка Neutron API (сети)
     try:
         print(f"  Checking Neutron API ({NEUTRON_API_URL})...")
         url = f"{NEUTRON_API_URL}/networks"
-        response = requests.get(url, headers=headers, timeout=10)
+        # Для проверки нужны только id и имя сети
+        params = {'fields': ['id', 'name']}
+        response = session.get(url, params=params, timeout=CONFIG.request_timeout)
         
         if response.status_code == 200:
             print("  Neutron API доступен")
             
             networks = response.json().get('networks', [])
-            ext_net = next((n for n in networks if n['id'] == EXTERNAL_NETWORK_ID or n['name'] == EXTERNAL_NETWORK_ID), None)
+            # Сеть можно указать и по id, и по имени; id имеет приоритет
+            networks_by_key = {n['name']: n for n in networks}
+            networks_by_key.update({n['id']: n for n in networks})
+            ext_net = networks_by_key.get(CONFIG.external_network_id)
             
             if ext_net:
                 print(f"     Внешняя сеть найдена: {ext_net.get('name')}")
             else:
-                print(f"     Сеть {EXTERNAL_NETWORK_ID} не найдена. Доступно сетей: {len(networks)}")
+                print(f"     Сеть {CONFIG.external_network_id} не найдена. Доступно сетей: {len(networks)}")
         else:
             print(f"  Ошибка Neutron API: {response.status_code}")
             print(f"     {response.text}")
@@ -79,8 +78,8 @@ def test_connection():
     # Тест 2: Проверка Nova API (серверы)
     try:
         print(f"  Checking Nova API ({NOVA_API_URL})...")
-        url = f"{NOVA_API_URL}/servers/{VM_ID}"
-        response = requests.get(url, headers=headers, timeout=10)
+        url = f"{NOVA_API_URL}/servers/{CONFIG.vm_id}"
+        response = session.get(url, timeout=CONFIG.request_timeout)
         
         if response.status_code == 200:
             print("  Nova API доступен и ВМ найдена")
@@ -88,12 +87,12 @@ def test_connection():
             print(f"     Статус: {vm_info.get('status')}")
             print(f"     Имя: {vm_info.get('name')}")
         elif response.status_code == 404:
-            print(f"  ВМ не найдена (ID: {VM_ID})")
+            print(f"  ВМ не найдена (ID: {CONFIG.vm_id})")
             
             # Попытка получить список всех серверов
             try:
                 list_url = f"{NOVA_API_URL}/servers/detail"
-                list_resp = requests.get(list_url, headers=headers, timeout=10)
+                list_resp = session.get(list_url, timeout=CONFIG.request_timeout)
                 if list_resp.status_code == 200:
                     servers = list_resp.json().get('servers', [])
                     print("\n  Доступные серверы в проекте:")
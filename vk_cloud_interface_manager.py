@@ -4,89 +4,84 @@ VK Cloud Network Interface Manager
 Управление сетевыми интерфейсами для поиска IP-адресов в определённых диапазонах
 """
 
+import atexit
+import itertools
 import threading
 from concurrent.futures import ThreadPoolExecutor
 import requests
 from requests.exceptions import ReadTimeout, ConnectTimeout
-from urllib3.util.retry import Retry
-from requests.adapters import HTTPAdapter
-import os
 import sys
 import time
 import logging
+import logging.handlers
+import queue
 import signal
+import socket
+import struct
 import json
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Iterator
 from datetime import datetime
-from dotenv import load_dotenv
 
-load_dotenv(override=True)
-
-# ===== КОНФИГУРАЦИЯ =====
-
-VK_CLOUD_TOKEN = os.getenv('VK_CLOUD_AUTH_TOKEN')
-PROJECT_ID = os.getenv('VK_CLOUD_PROJECT_ID')
-REGION = os.getenv('VK_CLOUD_REGION', 'RegionOne')
-
-NOVA_API_URL = 'https://infra.mail.ru:8774/v2.1'
-NEUTRON_API_URL = 'https://infra.mail.ru:9696/v2.0'
-
-VM_ID = os.getenv('VM_ID')
-EXTERNAL_NETWORK_ID = os.getenv('EXTERNAL_NETWORK_ID', 'ext-net')
-NUM_PORTS = int(os.getenv('NUM_PORTS', '5'))
-SAFE_IP = os.getenv('SAFE_IP')
-
-TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
-
-IP_RANGE_1_START = os.getenv('IP_RANGE_1_START', '95.163.248.10')
-IP_RANGE_1_END = os.getenv('IP_RANGE_1_END', '95.163.251.250')
-IP_RANGE_2_START = os.getenv('IP_RANGE_2_START', '217.16.24.1')
-IP_RANGE_2_END = os.getenv('IP_RANGE_2_END', '217.16.27.253')
-
-LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
-LOG_FILE = os.getenv('LOG_FILE', 'vk_cloud_manager.log')
-
-IP_WAIT_TIMEOUT = int(os.getenv('IP_WAIT_TIMEOUT', '60'))
-CHECK_INTERVAL = int(os.getenv('CHECK_INTERVAL', '2'))
-MAX_RETRIES = int(os.getenv('MAX_RETRIES', '100'))
-REQUEST_TIMEOUT = 60
+from config import NOVA_API_URL, NEUTRON_API_URL, CLEANUP_WORKERS, CONFIG, create_session
 
 # ===== ЛОГИРОВАНИЕ =====
 
 if sys.platform == 'win32':
     sys.stdout.reconfigure(encoding='utf-8')
 
+# Воркеры только кладут записи в очередь, запись в stdout и файл делает поток слушателя
+log_queue = queue.SimpleQueue()
+log_formatter = logging.Formatter('[%(asctime)s] %(levelname)s: %(message)s')
+log_handlers = [logging.StreamHandler(sys.stdout)]
+if CONFIG.log_file:
+    log_handlers.append(logging.FileHandler(CONFIG.log_file, encoding='utf-8'))
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers)
 logging.basicConfig(
-    level=getattr(logging, LOG_LEVEL),
-    format='[%(asctime)s] %(levelname)s: %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler(LOG_FILE, encoding='utf-8') if LOG_FILE else logging.NullHandler()
-    ]
+    level=getattr(logging, CONFIG.log_level),
+    format='%(message)s',
+    handlers=[logging.handlers.QueueHandler(log_queue)]
 )
+log_listener.start()
+# stop() дописывает очередь до конца; atexit срабатывает и после sys.exit в validate_config
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # ===== ГЛОБАЛЬНЫЕ ПЕРЕМЕННЫЕ =====
 
 stop_event = threading.Event()
-pool_semaphore = None 
-shutdown_requested = False
+found_ip: Optional[str] = None
+
+vm_ports_lock = threading.Lock()
+vm_ports_snapshot: Dict[str, Dict] = {}
+vm_ports_updated_at = 0.0
+vm_ports_refreshing = False
 
 # ===== ФУНКЦИИ ВАЛИДАЦИИ =====
 
 def validate_config():
     """Проверка обязательных параметров конфигурации"""
-    errors = []
+    errors = list(CONFIG.errors)
     
-    if not VK_CLOUD_TOKEN:
+    if not CONFIG.vk_cloud_token:
         errors.append("VK_CLOUD_AUTH_TOKEN не установлен")
-    if not PROJECT_ID:
+    if not CONFIG.project_id:
         errors.append("VK_CLOUD_PROJECT_ID не установлен")
-    if not VM_ID:
+    if not CONFIG.vm_id:
         errors.append("VM_ID не установлен")
-    if not EXTERNAL_NETWORK_ID:
+    if not CONFIG.external_network_id:
         errors.append("EXTERNAL_NETWORK_ID не установлен")
+    for range_num in (1, 2):
+        bounds = []
+        for name in (f'IP_RANGE_{range_num}_START', f'IP_RANGE_{range_num}_END'):
+            value = getattr(CONFIG, name.lower())
+            try:
+                bounds.append(ip_to_int(value))
+            except (OSError, TypeError):
+                errors.append(f"{name} не является IPv4-адресом: {value}")
+        if len(bounds) == 2 and bounds[0] > bounds[1]:
+            errors.append(f"IP_RANGE_{range_num}_START больше IP_RANGE_{range_num}_END: диапазон пуст")
     
     if errors:
         logger.error("Ошибки конфигурации:")
@@ -97,29 +92,18 @@ def validate_config():
     logger.info("Конфигурация валидна")
     return True
 
-# ===== HTTP СЕССИЯ =====
-
-def create_session():
-    """Создание сессии с retry стратегией"""
-    session = requests.Session()
-    retry = Retry(
-        total=MAX_RETRIES,
-        backoff_factor=0.3,
-        status_forcelist=(500, 502, 504)
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount('http://', adapter)
-    session.mount('https://', adapter)
-    return session
-
 # ===== API ЗАПРОСЫ =====
 
-def get_headers():
-    return {
-        'X-Auth-Token': VK_CLOUD_TOKEN,
-        'Content-Type': 'application/json',
-        'Accept': 'application/json'
-    }
+# Из описания порта используются только эти поля - остальное Neutron не передаёт
+PORT_FIELDS = {'fields': ['id', 'device_id', 'fixed_ips']}
+
+def log_api_error(prefix: str, e: Exception):
+    """Залогировать ошибку API-запроса вместе с телом ответа, если он есть"""
+    response = getattr(e, 'response', None)
+    if response is not None:
+        logger.error(f"{prefix}: {e}\nResponse: {response.text}")
+    else:
+        logger.error(f"{prefix}: {e}")
 
 def create_port(session: requests.Session, network_id: str) -> Optional[Dict]:
     """Создать сетевой порт"""
@@ -132,137 +116,262 @@ def create_port(session: requests.Session, network_id: str) -> Optional[Dict]:
             }
         }
         
-        response = session.post(url, json=payload, headers=get_headers(), timeout=REQUEST_TIMEOUT)
+        response = session.post(url, json=payload, timeout=CONFIG.post_timeout)
         response.raise_for_status()
         
         port_data = response.json().get('port')
-        logger.info(f"Порт создан: {port_data.get('id')}")
+        logger.info("Порт создан: %s", port_data.get('id'))
         return port_data
         
     except Exception as e:
-        error_msg = f"Ошибка при создании порта: {e}"
-        if hasattr(e, 'response') and e.response is not None:
-            error_msg += f"\nResponse: {e.response.text}"
-        logger.error(error_msg)
+        log_api_error("Ошибка при создании порта", e)
         return None
 
 def attach_port_to_vm(session: requests.Session, port_id: str) -> bool:
     """Подключить порт к виртуальной машине"""
     try:
-        url = f"{NOVA_API_URL}/servers/{VM_ID}/os-interface"
+        url = f"{NOVA_API_URL}/servers/{CONFIG.vm_id}/os-interface"
         payload = {
             "interfaceAttachment": {
                 "port_id": port_id
             }
         }
         
-        response = session.post(url, json=payload, headers=get_headers(), timeout=REQUEST_TIMEOUT)
+        response = session.post(url, json=payload, timeout=CONFIG.post_timeout)
         response.raise_for_status()
         
-        logger.info(f"Порт {port_id} подключен к ВМ")
+        logger.info("Порт %s подключен к ВМ", port_id)
         return True
         
     except Exception as e:
-        logger.error(f"Ошибка при подключении порта: {e}")
+        log_api_error("Ошибка при подключении порта", e)
         return False
 
 def get_port_info(session: requests.Session, port_id: str) -> Optional[Dict]:
     """Получить информацию о порте (включая IP)"""
     try:
         url = f"{NEUTRON_API_URL}/ports/{port_id}"
-        response = session.get(url, headers=get_headers(), timeout=REQUEST_TIMEOUT)
+        response = session.get(url, params=PORT_FIELDS, timeout=CONFIG.request_timeout)
         response.raise_for_status()
         
         return response.json().get('port')
         
     except Exception as e:
-        logger.error(f"Ошибка при получении информации о порте: {e}")
+        log_api_error("Ошибка при получении информации о порте", e)
         return None
 
+def get_all_vm_ports(session: requests.Session) -> Optional[Dict[str, Dict]]:
+    """Получить все порты ВМ одним запросом (фильтр по device_id на стороне Neutron)"""
+    try:
+        url = f"{NEUTRON_API_URL}/ports"
+        params = {'device_id': CONFIG.vm_id, 'fields': ['id', 'fixed_ips']}
+        response = session.get(url, params=params, timeout=CONFIG.request_timeout)
+        response.raise_for_status()
+        
+        return {port['id']: port for port in response.json().get('ports', [])}
+        
+    except Exception as e:
+        log_api_error("Ошибка при получении списка портов ВМ", e)
+        return None
+
+def get_vm_port_info(session: requests.Session, port_id: str, max_age: float) -> Optional[Dict]:
+    """Информация о порте из общего снимка портов ВМ.
+    
+    Снимок обновляет один воркер, если он старше max_age; остальные в это время
+    читают текущий снимок, поэтому одновременные опросы дают один запрос вместо NUM_PORTS.
+    Если порта в снимке нет (ещё не привязан), запрашиваем его отдельно.
+    """
+    global vm_ports_snapshot, vm_ports_updated_at, vm_ports_refreshing
+    
+    # Под блокировкой только проверка возраста и захват обновления: HTTP-запрос
+    # с ретраями не должен держать остальных воркеров
+    with vm_ports_lock:
+        port_info = vm_ports_snapshot.get(port_id)
+        refresh = (
+            port_info is not None
+            and not vm_ports_refreshing
+            and time.monotonic() - vm_ports_updated_at >= max_age
+        )
+        if refresh:
+            vm_ports_refreshing = True
+    
+    if refresh:
+        ports = None
+        try:
+            ports = get_all_vm_ports(session)
+        finally:
+            with vm_ports_lock:
+                if ports is not None:
+                    vm_ports_snapshot = ports
+                    vm_ports_updated_at = time.monotonic()
+                vm_ports_refreshing = False
+        port_info = ports.get(port_id) if ports is not None else port_info
+    
+    if port_info is None:
+        # Порта нет в снимке - общий запрос его всё равно не покажет, идём напрямую
+        port_info = get_port_info(session, port_id)
+        if port_info and port_info.get('device_id') == CONFIG.vm_id:
+            # Порт уже на ВМ: дальше его опрос пойдёт через общий снимок
+            with vm_ports_lock:
+                vm_ports_snapshot.setdefault(port_id, port_info)
+    return port_info
+
 def detach_port_from_vm(session: requests.Session, port_id: str) -> bool:
     """Отключить порт от виртуальной машины"""
     try:
-        url = f"{NOVA_API_URL}/servers/{VM_ID}/os-interface/{port_id}"
-        response = session.delete(url, headers=get_headers(), timeout=REQUEST_TIMEOUT)
+        url = f"{NOVA_API_URL}/servers/{CONFIG.vm_id}/os-interface/{port_id}"
+        response = session.delete(url, timeout=CONFIG.request_timeout)
         if response.status_code != 404:
             response.raise_for_status()
         
-        logger.info(f"Порт {port_id} отключен от ВМ")
+        logger.info("Порт %s отключен от ВМ", port_id)
         return True
         
     except Exception as e:
-        logger.error(f"Ошибка при отключении порта: {e}")
+        log_api_error("Ошибка при отключении порта", e)
         return False
 
 def delete_port(session: requests.Session, port_id: str) -> bool:
     """Удалить сетевой порт"""
     try:
         url = f"{NEUTRON_API_URL}/ports/{port_id}"
-        response = session.delete(url, headers=get_headers(), timeout=REQUEST_TIMEOUT)
+        response = session.delete(url, timeout=CONFIG.request_timeout)
         if response.status_code != 404:
              response.raise_for_status()
         
-        logger.info(f"Порт {port_id} удален")
+        logger.info("Порт %s удален", port_id)
         return True
         
     except Exception as e:
-        logger.error(f"Ошибка при удалении порта: {e}")
+        log_api_error("Ошибка при удалении порта", e)
         return False
 
+DETACH_WAIT_ATTEMPTS = 5
+DETACH_POLL_INTERVAL = 0.5
+
+DELETE_ATTEMPTS = 3
+DELETE_RETRY_INTERVAL = 5
+
+def wait_port_detached(session: requests.Session, port_id: str) -> bool:
+    """Дождаться, пока Nova отвяжет порт (device_id станет пустым), но не дольше нескольких проверок"""
+    for _ in range(DETACH_WAIT_ATTEMPTS):
+        port_info = get_port_info(session, port_id)
+        if port_info is None or not port_info.get('device_id'):
+            return True
+        time.sleep(DETACH_POLL_INTERVAL)
+    return False
+
+def delete_port_with_retry(session: requests.Session, port_id: str) -> bool:
+    """Удалить порт, повторив попытку при неудаче: утёкший порт занимает квоту до перезапуска"""
+    for attempt in range(1, DELETE_ATTEMPTS + 1):
+        if delete_port(session, port_id):
+            return True
+        if attempt < DELETE_ATTEMPTS:
+            # Обычный sleep: при завершении порт всё равно нужно удалить
+            time.sleep(DELETE_RETRY_INTERVAL)
+    return False
+
+def detach_and_delete_port(session: requests.Session, port_id: str) -> bool:
+    """Отключить порт от ВМ и удалить его, как только отключение завершится"""
+    detach_port_from_vm(session, port_id)
+    wait_port_detached(session, port_id)
+    return delete_port_with_retry(session, port_id)
+
 # ===== ПРОВЕРКА IP =====
 
+# Формат разбирается один раз, а не при каждом вызове struct.unpack
+IPV4_STRUCT = struct.Struct('!I')
+
 def ip_to_int(ip: str) -> int:
-    parts = ip.split('.')
-    return (int(parts[0]) << 24) + (int(parts[1]) << 16) + (int(parts[2]) << 8) + int(parts[3])
+    # inet_pton принимает только полную запись a.b.c.d: inet_aton понял бы
+    # '95.163.248' как 95.163.0.248, а '010' как восьмеричное 8
+    return IPV4_STRUCT.unpack(socket.inet_pton(socket.AF_INET, ip))[0]
+
+def int_to_ip(ip_num: int) -> str:
+    return socket.inet_ntoa(IPV4_STRUCT.pack(ip_num))
+
+def load_ip_ranges() -> List[Tuple[int, int]]:
+    """Перевести границы диапазонов из конфигурации в числа (после validate_config)"""
+    return [
+        (ip_to_int(CONFIG.ip_range_1_start), ip_to_int(CONFIG.ip_range_1_end)),
+        (ip_to_int(CONFIG.ip_range_2_start), ip_to_int(CONFIG.ip_range_2_end)),
+    ]
 
-def check_ip_in_range(ip: str, range_start: str, range_end: str) -> bool:
+# Границы не меняются во время работы - переводим в числа один раз в main,
+# после проверки конфигурации, чтобы опечатка в .env не падала трейсбеком при импорте
+ALLOWED_IP_RANGES: List[Tuple[int, int]] = []
+
+def is_ip_in_allowed_ranges(ip: str) -> bool:
     try:
         ip_num = ip_to_int(ip)
-        start_num = ip_to_int(range_start)
-        end_num = ip_to_int(range_end)
-        return start_num <= ip_num <= end_num
-    except:
+    except (OSError, TypeError):
         return False
-
-def is_ip_in_allowed_ranges(ip: str) -> bool:
-    if check_ip_in_range(ip, IP_RANGE_1_START, IP_RANGE_1_END):
-        logger.info(f"IP {ip} найден в диапазоне 1: {IP_RANGE_1_START}-{IP_RANGE_1_END}")
-        return True
     
-    if check_ip_in_range(ip, IP_RANGE_2_START, IP_RANGE_2_END):
-        logger.info(f"IP {ip} найден в диапазоне 2: {IP_RANGE_2_START}-{IP_RANGE_2_END}")
-        return True
+    for range_num, (start_num, end_num) in enumerate(ALLOWED_IP_RANGES, 1):
+        if start_num <= ip_num <= end_num:
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("IP %s найден в диапазоне %d: %s-%s", ip, range_num, int_to_ip(start_num), int_to_ip(end_num))
+            return True
     
     return False
 
 def extract_ip(port_info: Dict) -> Optional[str]:
-    try:
-        fixed_ips = port_info.get('fixed_ips', [])
-        if fixed_ips and len(fixed_ips) > 0:
-            return fixed_ips[0].get('ip_address')
-    except:
-        pass
-    return None
+    fixed_ips = port_info.get('fixed_ips')
+    return fixed_ips[0].get('ip_address') if fixed_ips else None
 
 # ===== TELEGRAM УВЕДОМЛЕНИЯ =====
 
+TELEGRAM_BATCH_WINDOW = 0.2
+
+# None, если уведомления не настроены
+TELEGRAM_URL = (
+    f"https://api.telegram.org/bot{CONFIG.telegram_bot_token}/sendMessage"
+    if CONFIG.telegram_bot_token and CONFIG.telegram_chat_id else None
+)
+
+telegram_queue: "queue.Queue[str]" = queue.Queue()
+
 def send_telegram_message(message: str) -> bool:
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
+    """Поставить сообщение в очередь на отправку, не блокируя вызывающий поток"""
+    if TELEGRAM_URL is None:
         return False
     
+    telegram_queue.put_nowait(message)
+    return True
+
+def post_telegram_message(session: requests.Session, message: str) -> bool:
     try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
         payload = {
-            "chat_id": TELEGRAM_CHAT_ID,
+            "chat_id": CONFIG.telegram_chat_id,
             "text": message,
             "parse_mode": "HTML"
         }
-        response = requests.post(url, json=payload, timeout=10)
+        response = session.post(TELEGRAM_URL, json=payload, timeout=(CONFIG.connect_timeout, 10))
         return response.status_code == 200
     except Exception as e:
         logger.warning(f"Не удалось отправить Telegram сообщение: {e}")
         return False
 
+def telegram_sender():
+    """Фоновый поток: склеивает сообщения, пришедшие за TELEGRAM_BATCH_WINDOW, в один запрос"""
+    # Отдельная сессия: на общей висит X-Auth-Token VK Cloud, его нельзя слать в Telegram
+    with requests.Session() as session:
+        while True:
+            messages = [telegram_queue.get()]
+            deadline = time.monotonic() + TELEGRAM_BATCH_WINDOW
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    messages.append(telegram_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            post_telegram_message(session, "\n".join(messages))
+            for _ in messages:
+                telegram_queue.task_done()
+
 # ===== ОЧИСТКА =====
 
 def cleanup_orphaned_ports(session: requests.Session):
@@ -270,90 +379,108 @@ def cleanup_orphaned_ports(session: requests.Session):
     logger.info("Запуск агрессивной очистки портов...")
     try:
         url = f"{NEUTRON_API_URL}/ports"
-        resp = session.get(url, headers=get_headers(), timeout=REQUEST_TIMEOUT)
+        resp = session.get(url, params=PORT_FIELDS, timeout=CONFIG.request_timeout)
         resp.raise_for_status()
         all_ports = resp.json().get('ports', [])
         
-        deleted_count = 0
+        orphaned = []
+        attached = []
         
         for port in all_ports:
             port_id = port.get('id')
             device_id = port.get('device_id')
             ips = [ip['ip_address'] for ip in port.get('fixed_ips', [])]
             
-            if SAFE_IP in ips:
-                logger.info(f"Порт {port_id} ({ips}) ЗАЩИЩЕН. Пропуск.")
+            if CONFIG.safe_ip in ips:
+                logger.info("Порт %s (%s) ЗАЩИЩЕН. Пропуск.", port_id, ips)
                 continue
             
-            should_delete = False
             if not device_id:
-                logger.info(f"Найден висячий порт {port_id} ({ips}). Удаляю...")
-                should_delete = True
-            elif device_id == VM_ID:
-                logger.info(f"Найден лишний порт на ВМ {port_id} ({ips}). Отключаю и удаляю...")
-                detach_port_from_vm(session, port_id)
-                time.sleep(1)
-                should_delete = True
-            
-            if should_delete:
-                if delete_port(session, port_id):
-                    deleted_count += 1
+                logger.info("Найден висячий порт %s (%s). Удаляю...", port_id, ips)
+                orphaned.append(port_id)
+            elif device_id == CONFIG.vm_id:
+                logger.info("Найден лишний порт на ВМ %s (%s). Отключаю и удаляю...", port_id, ips)
+                attached.append(port_id)
+        
+        deleted_count = 0
+        if orphaned or attached:
+            # Каждый порт обрабатывается независимо: висячие сразу удаляются,
+            # привязанные удаляются сразу после своего отключения
+            with ThreadPoolExecutor(max_workers=min(CLEANUP_WORKERS, len(orphaned) + len(attached))) as executor:
+                deleted = executor.map(lambda port_id: delete_port(session, port_id), orphaned)
+                detached_deleted = executor.map(lambda port_id: detach_and_delete_port(session, port_id), attached)
+                deleted_count = sum(deleted) + sum(detached_deleted)
                     
-        logger.info(f"Очистка завершена. Удалено: {deleted_count}")
+        logger.info("Очистка завершена. Удалено: %d", deleted_count)
             
     except Exception as e:
         logger.error(f"Ошибка при очистке портов: {e}")
 
 # ===== ПОТОЧНАЯ ЛОГИКА =====
 
-def worker_task(task_id: int):
+def worker_task(session: requests.Session, task_id: int):
     """Задача для одного потока: создать, проверить, удалить/оставить"""
-    
-    if stop_event.is_set() or shutdown_requested:
-        pool_semaphore.release()
-        return
-
-    session = create_session()
+    global found_ip
     port_id = None
+    attach_requested = False
     
     try:
-        logger.info(f"[Поток {task_id}] Начинаю поиск...")
+        logger.info("[Поток %d] Начинаю поиск...", task_id)
         
-        port_info = create_port(session, EXTERNAL_NETWORK_ID)
+        port_info = create_port(session, CONFIG.external_network_id)
         if not port_info:
-            logger.warning(f"[Поток {task_id}] Не удалось создать порт. Ретрай...")
-            return 
+            logger.warning("[Поток %d] Не удалось создать порт. Ретрай...", task_id)
+            # Пауза перед освобождением слота, чтобы при квоте/лимитах не долбить API
+            stop_event.wait(CONFIG.check_interval)
+            return
             
         port_id = port_info['id']
         
+        # Внешняя сеть обычно выдаёт IP уже при создании порта: неподходящий
+        # порт удаляем сразу, без подключения к ВМ и ожидания
+        ip = extract_ip(port_info)
+        if ip and not is_ip_in_allowed_ranges(ip):
+            logger.info("[Поток %d] IP %s не подходит.", task_id, ip)
+            return
+        # Подходящий IP из ответа уже проверен - при опросе не ищем диапазон повторно
+        checked_ip = ip
+        
         if stop_event.is_set():
             return
 
+        attach_requested = True
         if not attach_port_to_vm(session, port_id):
             return
 
-        start_time = time.time()
+        # monotonic не зависит от перевода системных часов
+        deadline = time.monotonic() + CONFIG.ip_wait_timeout
         ip_found = False
+        # Первые проверки частые, затем интервал растёт до CHECK_INTERVAL
+        delay = CONFIG.poll_backoff_base
         
-        while time.time() - start_time < 40:
-            if stop_event.is_set() or shutdown_requested:
-                return
-
-            port_info = get_port_info(session, port_id)
+        while time.monotonic() < deadline:
+            port_info = get_vm_port_info(session, port_id, max_age=delay)
             if port_info:
                 ip = extract_ip(port_info)
                 if ip:
-                    if is_ip_in_allowed_ranges(ip):
-                        logger.info(f"\n[Поток {task_id}] НАЙДЕН IP: {ip}!")
+                    if ip == checked_ip or is_ip_in_allowed_ranges(ip):
+                        logger.info("\n[Поток %d] НАЙДЕН IP: %s!", task_id, ip)
                         send_telegram_message(f"Найден IP: {ip}")
+                        found_ip = ip
                         stop_event.set()
                         ip_found = True
                         return
                     else:
-                        logger.info(f"[Поток {task_id}] IP {ip} не подходит.")
+                        logger.info("[Поток %d] IP %s не подходит.", task_id, ip)
                         break
+            else:
+                # Запрос не удался - после восстановления API проверяем снова быстро
+                delay = CONFIG.poll_backoff_base
             
-            time.sleep(2)
+            # wait() просыпается сразу по Ctrl+C или когда другой поток нашёл IP
+            if stop_event.wait(delay):
+                return
+            delay = min(delay * 2, CONFIG.check_interval)
             
     except Exception as e:
         logger.error(f"[Поток {task_id}] Ошибка: {e}")
@@ -364,25 +491,26 @@ def worker_task(task_id: int):
             should_cleanup = False
             
         if should_cleanup and port_id:
-            logger.info(f"[Поток {task_id}] Удаление порта {port_id}...")
-            detach_port_from_vm(session, port_id)
-            time.sleep(1) 
-            delete_port(session, port_id)
-            
-        session.close()
-        pool_semaphore.release()
+            logger.info("[Поток %d] Удаление порта %s...", task_id, port_id)
+            if attach_requested:
+                detach_and_delete_port(session, port_id)
+            else:
+                delete_port_with_retry(session, port_id)
+
+def worker_loop(session: requests.Session, task_ids: Iterator[int]):
+    """Постоянный поток пула: запускает поиск за поиском, пока не будет сигнала остановки"""
+    while not stop_event.is_set():
+        worker_task(session, next(task_ids))
 
 def signal_handler(sig, frame):
     """Обработчик сигнала Ctrl+C"""
-    global shutdown_requested
-    shutdown_requested = True
     stop_event.set()
     logger.warning("Получена команда завершения (Ctrl+C)")
     logger.info("Выполняется очистка... Пожалуйста, подождите.")
 
 def main():
     """Основная функция"""
-    global pool_semaphore
+    global ALLOWED_IP_RANGES
     signal.signal(signal.SIGINT, signal_handler)
     
     logger.info("VK Cloud Network Interface Manager (Multi-threaded)")
@@ -390,30 +518,33 @@ def main():
     
     if not validate_config():
         sys.exit(1)
+    ALLOWED_IP_RANGES = load_ip_ranges()
         
-    session = create_session()
+    # Сессия общая для всех воркеров и очистки, поэтому пул соединений
+    # должен вмещать все одновременные запросы
+    session = create_session(
+        pool_maxsize=max(2 * CONFIG.num_ports, CLEANUP_WORKERS),
+        max_retries=CONFIG.max_retries
+    )
     cleanup_orphaned_ports(session)
-    session.close()
     
-    pool_semaphore = threading.BoundedSemaphore(NUM_PORTS)
+    if TELEGRAM_URL is not None:
+        threading.Thread(target=telegram_sender, name="telegram", daemon=True).start()
     
-    logger.info(f"Запуск пула потоков ({NUM_PORTS} воркеров)...")
+    logger.info(f"Запуск пула потоков ({CONFIG.num_ports} воркеров)...")
     
-    with ThreadPoolExecutor(max_workers=NUM_PORTS) as executor:
-        task_counter = 0
-        
-        while not stop_event.is_set() and not shutdown_requested:
-            pool_semaphore.acquire() 
+    # Номера задач общие для всех потоков; next() у itertools.count атомарен под GIL
+    task_ids = itertools.count(1)
+    with ThreadPoolExecutor(max_workers=CONFIG.num_ports) as executor:
+        for _ in range(CONFIG.num_ports):
+            executor.submit(worker_loop, session, task_ids)
             
-            if stop_event.is_set() or shutdown_requested:
-                break
-                
-            task_counter += 1
-            executor.submit(worker_task, task_counter)
-            
-            time.sleep(1.0)
-            
-    if stop_event.is_set():
+    session.close()
+    # Дожидаемся отправки уведомлений до выхода: поток отправки - демон
+    telegram_queue.join()
+    
+    # stop_event выставляется и при найденном IP, и по Ctrl+C
+    if found_ip:
         logger.info("Программа завершена: IP найден!")
     else:
         logger.info("Программа завершена пользователем")